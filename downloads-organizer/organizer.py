@@ -1,5 +1,12 @@
+import argparse
+import errno
 import os
 import shutil
+import stat
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
 # Map file extensions to folder names
@@ -92,42 +99,334 @@ EXTENSION_MAP = {
     "Others": []
 }
 
+# Freeze each category's extensions so membership tests are O(1) hash lookups
+EXTENSION_MAP = {folder_name: frozenset(extensions) for folder_name, extensions in EXTENSION_MAP.items()}
+
+# Category folder names, skipped when scanning the Downloads folder
+CATEGORY_NAMES = frozenset(EXTENSION_MAP)
+
+def _build_ext_to_folder():
+    """
+    Flatten EXTENSION_MAP into {extension: folder name}. The first category
+    listing an extension wins (e.g. ".bin" stays in "Programs", not "DiscImages").
+    """
+    ext_to_folder = {}
+    for folder_name, extensions in EXTENSION_MAP.items():
+        for ext in extensions:
+            ext_to_folder.setdefault(ext, folder_name)
+    return ext_to_folder
+
+# Flat lookup of extension -> folder name, built once at import
+EXT_TO_FOLDER = _build_ext_to_folder()
+
+@lru_cache(maxsize=512)
+def _classify(ext: str) -> str:
+    """Return the folder name for a raw (any case) file extension."""
+    return EXT_TO_FOLDER.get(ext.lower(), "Others")
+
 
 # Adjust this path if your Downloads folder is in a different location
 DOWNLOADS_FOLDER = Path.home() / "Downloads"
 
+# Extensions browsers use while a download is in progress. Watch mode waits
+# for these to be renamed to their final name before moving them.
+PARTIAL_DOWNLOAD_EXTENSIONS = frozenset({".crdownload", ".part", ".partial", ".download", ".tmp"})
+
+# Watch mode: how long a newly created file must keep the same size before it
+# is moved, when no close event arrives (files renamed or hard-linked in)
+CREATED_SETTLE_SECONDS = 2
+
+def _kernel_copy(src_fd, dst_fd, size):
+    """
+    Copy size bytes between file descriptors without Python-level buffers.
+    Returns the number of bytes actually copied.
+    """
+    offset = 0
+    use_copy_file_range = hasattr(os, "copy_file_range")
+    while offset < size:
+        if use_copy_file_range:
+            try:
+                copied = os.copy_file_range(src_fd, dst_fd, size - offset)
+            except OSError as e:
+                # Unsupported for this pair of filesystems, use sendfile instead
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+                copied = 0
+            if copied == 0:
+                # Some filesystems report "nothing copied" instead of an error
+                use_copy_file_range = False
+                continue
+        else:
+            copied = os.sendfile(dst_fd, src_fd, offset, size - offset)
+            if copied == 0:
+                break
+        offset += copied
+    return offset
+
+# Serializes the check-then-rename fallback between our own move workers
+_rename_lock = threading.Lock()
+
+def _rename_no_clobber(src, dst):
+    """Rename src to dst, raising FileExistsError rather than replacing dst."""
+    if os.name == "nt":
+        # Windows rename already refuses to replace an existing file
+        os.rename(src, dst)
+        return
+    try:
+        # Unlike rename(2), link(2) fails with EEXIST instead of replacing dst
+        os.link(src, dst)
+    except OSError as e:
+        # EEXIST and EXDEV go to the caller; anything else means no hard links
+        if e.errno not in (errno.EPERM, errno.EOPNOTSUPP, errno.ENOSYS, errno.EMLINK):
+            raise
+        # Filesystem without hard links (e.g. FAT): check and rename under a lock
+        with _rename_lock:
+            if os.path.lexists(dst):
+                raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+            os.rename(src, dst)
+        return
+    os.unlink(src)
+
+def _fast_move(src, dst):
+    """
+    Move src to dst without ever replacing an existing dst (FileExistsError),
+    copying in the kernel when they are on different devices.
+    """
+    try:
+        # Same filesystem: O(1) whatever the file size
+        _rename_no_clobber(src, dst)
+        return
+    except OSError as e:
+        # Category folder is on another device (e.g. a symlinked subdir)
+        if e.errno != errno.EXDEV:
+            raise
+
+    # Only remove the source once the destination holds a complete copy.
+    # dst is created (O_EXCL) outside the try, so a failure to open either
+    # file never deletes something this call didn't create.
+    with open(src, "rb") as fsrc:
+        fdst = open(dst, "xb")
+        try:
+            with fdst:
+                size = os.fstat(fsrc.fileno()).st_size
+                # sendfile() into a regular file is only supported on Linux
+                if sys.platform.startswith("linux"):
+                    copied = _kernel_copy(fsrc.fileno(), fdst.fileno(), size)
+                else:
+                    shutil.copyfileobj(fsrc, fdst)
+                    copied = fdst.tell()
+                if copied != size:
+                    raise OSError(errno.EIO, f"Copied {copied} of {size} bytes", src)
+            shutil.copystat(src, dst)
+        except BaseException:
+            try:
+                os.unlink(dst)
+            except OSError:
+                pass
+            raise
+    os.unlink(src)
+
+def _report_move(src, dst):
+    """Print where a file went, including its new name if it was renamed."""
+    name, new_name = os.path.basename(src), os.path.basename(dst)
+    renamed = f" as {new_name}" if new_name != name else ""
+    print(f"Moved {name} to {os.path.dirname(dst)}{renamed}")
+
+def _move_no_clobber(src, dst):
+    """
+    Move src to dst, or to the first free "name (1).ext", "name (2).ext", ...
+    if dst is taken when the move happens. Returns where the file went.
+    """
+    base, ext = os.path.splitext(dst)
+    target, n = dst, 0
+    while True:
+        try:
+            _fast_move(src, target)
+            return target
+        except FileExistsError:
+            n += 1
+            target = f"{base} ({n}){ext}"
+
+def _move_one(move):
+    """Move a single (source, destination) pair, returning (source, final destination)."""
+    src, dst = move
+    return src, _move_no_clobber(src, dst)
+
+def _folder_paths(download_folder):
+    """Map each category name to its folder path, as a plain string."""
+    base = os.fspath(download_folder)
+    return {name: os.path.join(base, name) for name in EXTENSION_MAP}
+
 def organize_downloads(download_folder: Path = DOWNLOADS_FOLDER):
     # Ensure the folder exists
     if not download_folder.exists():
         print(f"Downloads folder not found: {download_folder}")
         return
 
-    # List all files in the folder
-    for item in download_folder.iterdir():
-        if item.is_file():
-            file_extension = item.suffix.lower()
-            moved = False
-
-            # Match file extension to a category
-            for folder_name, extensions in EXTENSION_MAP.items():
-                if file_extension in extensions:
-                    target_folder = download_folder / folder_name
-                    target_folder.mkdir(exist_ok=True)
-                    shutil.move(str(item), str(target_folder / item.name))
-                    print(f"Moved {item.name} to {target_folder}")
-                    moved = True
-                    break
-            
-            # If not matched, move to 'Others' folder
-            if not moved:
-                others_folder = download_folder / "Others"
-                others_folder.mkdir(exist_ok=True)
-                shutil.move(str(item), str(others_folder / item.name))
-                print(f"Moved {item.name} to {others_folder}")
+    # Plain strings avoid building Path objects for every file
+    folder_paths = _folder_paths(download_folder)
+
+    # List all files in the folder; scandir caches the file type from readdir
+    pending = []
+    with os.scandir(download_folder) as it:
+        for entry in it:
+            # Skip our own category folders and hidden files before any stat
+            if entry.name in CATEGORY_NAMES or entry.name.startswith("."):
+                continue
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            # Match file extension to a category, 'Others' if not matched
+            folder_name = _classify(os.path.splitext(entry.name)[1])
+            pending.append((entry.name, entry.path, folder_name))
+
+    # Create each needed category folder once, rather than once per file
+    for folder_name in {folder_name for _, _, folder_name in pending}:
+        os.makedirs(folder_paths[folder_name], exist_ok=True)
+
+    # Names are resolved at move time, so nothing in a category folder is overwritten
+    moves = [
+        (path, os.path.join(folder_paths[folder_name], name))
+        for name, path, folder_name in pending
+    ]
+    # Moves are I/O bound (cross-device ones copy data), so overlap them
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for src, dst in executor.map(_move_one, moves):
+            _report_move(src, dst)
+
+def organize_downloads_daemon(download_folder: Path = DOWNLOADS_FOLDER) -> bool:
+    """
+    Organize the folder once, then move each new file as it arrives.
+    Returns False if watch mode could not be started.
+    """
+    # watchdog is only needed for watch mode, keep the one-shot run stdlib only
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        print("Watch mode needs the 'watchdog' package: pip install watchdog")
+        return False
+
+    if not download_folder.exists():
+        print(f"Downloads folder not found: {download_folder}")
+        return False
+    organize_downloads(download_folder)
+    watch_path = os.fspath(download_folder)
+    # inotify reports IN_CLOSE_WRITE; other platforms only tell us about creation
+    has_close_events = sys.platform.startswith("linux")
+    folder_paths = _folder_paths(download_folder)
+
+    class NewFileHandler(FileSystemEventHandler):
+        def __init__(self):
+            super().__init__()
+            self._lock = threading.Lock()
+            self._settle_timers = {}  # path -> Timer waiting for its size to settle
+
+        def _organize(self, path):
+            with self._lock:
+                timer = self._settle_timers.pop(path, None)
+                if timer:
+                    timer.cancel()
+                self._organize_locked(path)
+
+        def _defer(self, path, last_size):
+            timer = threading.Timer(CREATED_SETTLE_SECONDS, self._settled, (path, last_size))
+            timer.daemon = True
+            with self._lock:
+                old_timer = self._settle_timers.get(path)
+                if old_timer:
+                    old_timer.cancel()
+                self._settle_timers[path] = timer
+            timer.start()
+
+        def _settled(self, path, last_size):
+            try:
+                size = os.lstat(path).st_size
+            except OSError:
+                # Already moved (e.g. by its close event) or deleted
+                return
+            if size != last_size:
+                # Still growing, check again later
+                self._defer(path, size)
+                return
+            self._organize(path)
+
+        def cancel_pending(self):
+            with self._lock:
+                for timer in self._settle_timers.values():
+                    timer.cancel()
+                self._settle_timers.clear()
+
+        def _organize_locked(self, path):
+            # Only top-level files; our own moves land in the category folders
+            if os.path.dirname(path) != watch_path:
+                return
+            # Regular files only, without following symlinks (as the batch scan does)
+            try:
+                if not stat.S_ISREG(os.lstat(path).st_mode):
+                    return
+            except OSError:
+                return
+            name = os.path.basename(path)
+            ext = os.path.splitext(name)[1]
+            if name in CATEGORY_NAMES or name.startswith(".") or ext.lower() in PARTIAL_DOWNLOAD_EXTENSIONS:
+                return
+            target_folder = folder_paths[_classify(ext)]
+            try:
+                os.makedirs(target_folder, exist_ok=True)
+                target_path = _move_no_clobber(path, os.path.join(target_folder, name))
+            except OSError as e:
+                print(f"Could not move {name}: {e}")
+                return
+            _report_move(path, target_path)
+
+        def on_created(self, event):
+            if event.is_directory:
+                return
+            if has_close_events:
+                # A new file may still be being written (curl, wget, cp, ...), so
+                # wait for on_closed. Files renamed or hard-linked in from
+                # elsewhere never get one; move those once their size settles.
+                self._defer(event.src_path, None)
+            else:
+                self._organize(event.src_path)
+
+        def on_closed(self, event):
+            # Linux (inotify) only: the writer has finished with the file
+            if not event.is_directory:
+                self._organize(event.src_path)
+
+        def on_moved(self, event):
+            # Browsers rename "file.crdownload" / "file.part" once complete
+            if not event.is_directory:
+                self._organize(event.dest_path)
+
+    handler = NewFileHandler()
+    observer = Observer()
+    observer.schedule(handler, watch_path, recursive=False)
+    observer.start()
+    print(f"Watching {download_folder} for new files, press Ctrl+C to stop")
+    try:
+        while observer.is_alive():
+            observer.join(1)
+    except KeyboardInterrupt:
+        observer.stop()
+    observer.join()
+    handler.cancel_pending()
+    return True
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Organize the Downloads folder by file type.")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and organize new files as they arrive (needs watchdog)")
+    args = parser.parse_args()
+
     # Run the organizer
-    organize_downloads()
+    if args.watch:
+        if not organize_downloads_daemon():
+            sys.exit(1)
+    else:
+        organize_downloads()
 
     # Print a fancy ASCII banner when done
     print(r"""
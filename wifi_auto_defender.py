@@ -1,11 +1,20 @@
 #!/usr/bin/env python3
 
+import fcntl
+import heapq
+import ipaddress
+import json
+import logging
 import os
 import sys
 import re
 import subprocess
+import threading
 import signal
+import socket
+import struct
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # ---------------------------
@@ -26,14 +35,75 @@ LOG_DIR = "./wifi_logs"
 if not os.path.exists(LOG_DIR):
     os.makedirs(LOG_DIR)
 
+# Keep one log file open for the whole run instead of reopening it per message
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+    handlers=[
+        logging.FileHandler(os.path.join(LOG_DIR, "wifi_defender.log")),
+        logging.StreamHandler(sys.stdout),
+    ],
+)
+_LOG = logging.getLogger("wifi_auto_defender")
+
 # Limit the number of old log files to keep
 MAX_LOG_FILES = 10
 
+# File remembering devices already handled, so restarts don't re-scan them
+SEEN_MACS_FILE = os.path.join(LOG_DIR, "seen_macs.json")
+
+# Minimum time before the same IP is Nmap-scanned again (in seconds)
+NMAP_RESCAN_INTERVAL = 3600
+
+# How many new devices to Nmap-scan in parallel
+NMAP_MAX_WORKERS = 8
+
 # Dictionary of known/trusted devices { MAC: Friendly Name }
 KNOWN_DEVICES = {
     "AA:BB:CC:DD:EE:11": "My Laptop",
     "AA:BB:CC:DD:EE:22": "My Phone",
 }
+# Normalize MACs to uppercase once, matching how discovered MACs are reported
+KNOWN_DEVICES = {mac.upper(): name for mac, name in KNOWN_DEVICES.items()}
+_KNOWN_MACS = frozenset(KNOWN_DEVICES)
+
+# IP and MAC columns of a netdiscover result line, e.g.
+# 192.168.1.10   00:11:22:33:44:55   1      60   SomeVendor
+_IP_RE = re.compile(r"^(\d+\.\d+\.\d+\.\d+)\s+([0-9A-Fa-f:]{17})")
+
+# Patterns for 'iw dev' and 'iw <if> link' output
+_INTERFACE_RE = re.compile(r"Interface\s+(\S+)")
+_CONNECTED_RE = re.compile(r"Connected to\s+([\da-fA-F:]+)\s+\(on\s+freq\s+(\d+)\)")
+_SSID_RE = re.compile(r"SSID:\s+(.+)")
+
+# ioctl requests for an interface's IPv4 address and netmask (linux/sockios.h)
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891B
+
+# Last Nmap scan time (time.monotonic()) per IP, shared by the scan workers
+_last_nmap_scan = {}
+_last_nmap_scan_lock = threading.Lock()
+
+# MACs whose scan is postponed because their IP was scanned recently
+_deferred_macs = set()
+
+# Results of handle_new_device(); only SCAN_DONE marks a device as seen
+SCAN_DONE = "done"
+SCAN_FAILED = "failed"
+SCAN_DEFERRED = "deferred"
+
+# Wi-Fi centre frequency (MHz) -> channel number
+# 2.4 GHz: channels 1-13 are 5 MHz apart from 2412, channel 14 is 2484
+FREQ_TO_CHANNEL = {2412 + 5 * i: 1 + i for i in range(13)}
+FREQ_TO_CHANNEL[2484] = 14
+# 5 GHz: frequency = 5000 + 5 * channel
+FREQ_TO_CHANNEL.update({
+    5000 + 5 * ch: ch
+    for ch in (36, 40, 44, 48, 52, 56, 60, 64,
+               100, 104, 108, 112, 116, 120, 124, 128, 132, 136, 140, 144,
+               149, 153, 157, 161, 165)
+})
 
 # ---------------------------
 # HELPER FUNCTIONS
@@ -47,18 +117,35 @@ def check_root():
 
 def rotate_logs(directory):
     """Keep only the newest logs up to MAX_LOG_FILES to prevent indefinite growth."""
-    files = sorted(os.listdir(directory), key=lambda x: os.path.getmtime(os.path.join(directory, x)))
-    while len(files) > MAX_LOG_FILES:
-        oldest = files.pop(0)
-        os.remove(os.path.join(directory, oldest))
+    # DirEntry.stat() reuses one stat per file; only order when over the limit
+    with os.scandir(directory) as it:
+        entries = [(e.stat().st_mtime, e.path) for e in it
+                   if e.is_file() and e.name != os.path.basename(SEEN_MACS_FILE)]
+    if len(entries) <= MAX_LOG_FILES:
+        return
+    for _, oldest in heapq.nsmallest(len(entries) - MAX_LOG_FILES, entries):
+        os.remove(oldest)
+
+def load_seen_macs():
+    """Return the MACs handled by previous runs, or an empty set."""
+    try:
+        with open(SEEN_MACS_FILE) as f:
+            macs = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    # Ignore anything that isn't the list of MAC strings save_seen_macs() writes
+    if not isinstance(macs, list):
+        return set()
+    return {mac.upper() for mac in macs if isinstance(mac, str)}
+
+def save_seen_macs(seen_macs):
+    """Save handled MACs to SEEN_MACS_FILE for the next run."""
+    with open(SEEN_MACS_FILE, "w") as f:
+        json.dump(sorted(seen_macs - _KNOWN_MACS), f)
 
 def log_message(message):
     """Write a log entry to a central file and print to console."""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_file_path = os.path.join(LOG_DIR, "wifi_defender.log")
-    with open(log_file_path, "a") as f:
-        f.write(f"[{timestamp}] {message}\n")
-    print(f"[{timestamp}] {message}")
+    _LOG.info(message)
 
 def run_command(cmd):
     """Run a shell command and return its stdout as text. Raises on error."""
@@ -88,7 +175,7 @@ def get_connected_wifi_interface():
     # We need to check if the interface is in "type managed" and also "Connected".
 
     # We'll also cross-check with "iw <if> link" to see if it's connected or not.
-    interfaces = re.findall(r"Interface\s+(\S+)", output)
+    interfaces = _INTERFACE_RE.findall(output)
     for iface in interfaces:
         try:
             link_info = run_command(["iw", iface, "link"])
@@ -101,10 +188,26 @@ def get_connected_wifi_interface():
             continue
     return None
 
+def get_interface_ipv4(interface):
+    """
+    Ask the kernel for the IPv4 address and netmask of an interface, without
+    spawning 'ip'. Returns an ipaddress.IPv4Interface, or None if unavailable.
+    """
+    # struct ifreq: 16-byte interface name, then a sockaddr_in holding the address
+    ifreq = struct.pack("256s", interface.encode()[:15])
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            addr = fcntl.ioctl(s.fileno(), SIOCGIFADDR, ifreq)[20:24]
+            netmask = fcntl.ioctl(s.fileno(), SIOCGIFNETMASK, ifreq)[20:24]
+    except OSError as e:
+        log_message(f"[!] Could not get IPv4 address of {interface}: {e}")
+        return None
+    return ipaddress.ip_interface(f"{socket.inet_ntoa(addr)}/{socket.inet_ntoa(netmask)}")
+
 def get_current_wifi_info(interface):
     """
     Parse 'iw <interface> link' to find the BSSID, channel (frequency), and SSID. 
-    Also parse 'ip -f inet address show dev <interface>' to find local IP and netmask.
+    Also look up the interface's local IP and netmask to derive its subnet.
     Returns a dict with keys: 'bssid', 'channel', 'ssid', 'ip_subnet'.
     """
     info = {
@@ -121,49 +224,21 @@ def get_current_wifi_info(interface):
         # Connected to aa:bb:cc:dd:ee:ff (on freq 2412)
         # SSID: MyHomeWiFi
         # ...
-        m_connected = re.search(r"Connected to\s+([\da-fA-F:]+)\s+\(on\s+freq\s+(\d+)\)", link_info)
+        m_connected = _CONNECTED_RE.search(link_info)
         if m_connected:
             info["bssid"] = m_connected.group(1).upper()
             freq = m_connected.group(2)
-            # Convert freq to channel (rough approximation for 2.4 GHz)
-            # For a robust approach, use a freq-to-channel mapping table.
-            # Common 2.4 GHz frequencies: 2412 (ch1), 2417 (ch2), ... 2462 (ch11)
-            # For 5 GHz, it's different. We'll do a minimal approach:
-            freq_int = int(freq)
-            if 2412 <= freq_int <= 2472:
-                # (freq - 2412)/5 + 1
-                channel = 1 + (freq_int - 2412)//5
-                info["channel"] = str(channel)
-            elif 5170 <= freq_int <= 5825:
-                # 5GHz channels
-                # This is more varied, but let's do a best guess or store freq
-                info["channel"] = freq
-            else:
-                info["channel"] = freq  # fallback
-        m_ssid = re.search(r"SSID:\s+(.+)", link_info)
+            # Convert freq to channel, keeping the raw freq if it's not in the table
+            info["channel"] = str(FREQ_TO_CHANNEL.get(int(freq), freq))
+        m_ssid = _SSID_RE.search(link_info)
         if m_ssid:
             info["ssid"] = m_ssid.group(1)
 
         # Next, get local IP and netmask
-        # We'll parse 'ip -f inet address show dev <interface>'
-        ip_info = run_command(["ip", "-f", "inet", "address", "show", "dev", interface])
-        # Example output:
-        # inet 192.168.1.101/24 brd 192.168.1.255 scope global dynamic wlan0
-        m_ip = re.search(r"inet\s+(\d+\.\d+\.\d+\.\d+\/\d+)", ip_info)
-        if m_ip:
-            cidr = m_ip.group(1)  # e.g. "192.168.1.101/24"
+        ip_interface = get_interface_ipv4(interface)
+        if ip_interface:
             # We'll convert e.g. 192.168.1.101/24 to 192.168.1.0/24 for scanning
-            ip, prefix = cidr.split("/")
-            octets = ip.split(".")
-            mask_int = int(prefix)
-            # A very simple approach for /24:
-            # If prefix=24, zero out last octet. For anything else, we do minimal approach.
-            if mask_int == 24:
-                net_addr = f"{octets[0]}.{octets[1]}.{octets[2]}.0/24"
-                info["ip_subnet"] = net_addr
-            else:
-                # fallback
-                info["ip_subnet"] = f"{ip}/{prefix}"
+            info["ip_subnet"] = str(ip_interface.network)
     except subprocess.CalledProcessError as e:
         log_message(f"[!] Error getting Wi-Fi info: {e}")
     
@@ -207,54 +282,81 @@ def launch_airodump(interface, bssid=None, channel=None):
 
 def run_netdiscover(subnet):
     """
-    Run netdiscover on the given subnet and return a list of (ip, mac).
+    Run netdiscover on the given subnet, yielding (ip, mac) as devices are found.
     """
     log_message(f"Running netdiscover on {subnet}...")
-    try:
-        result = subprocess.run(["netdiscover", "-r", subnet], capture_output=True, text=True, check=True)
-    except subprocess.CalledProcessError as e:
+    cmd = ["netdiscover", "-r", subnet]
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                          text=True, bufsize=1) as proc:
+        for line in proc.stdout:
+            m = _IP_RE.match(line)
+            if m:
+                yield m.group(1), m.group(2).upper()
+    if proc.returncode != 0:
+        e = subprocess.CalledProcessError(proc.returncode, cmd)
         log_message(f"[!] netdiscover error: {e}")
-        return []
-
-    discovered = []
-    lines = result.stdout.strip().split('\n')
-    for line in lines:
-        # Typical netdiscover lines look like:
-        # 192.168.1.10   00:11:22:33:44:55   1      60   SomeVendor
-        if re.match(r"^\d+\.\d+\.\d+\.\d+", line):
-            parts = line.split()
-            if len(parts) >= 2:
-                ip = parts[0]
-                mac = parts[1].upper()
-                discovered.append((ip, mac))
-    return discovered
 
 def run_nmap_scan(ip):
     """
     Perform a basic Nmap scan on a single IP. 
-    Returns the stdout for logging.
+    Yields the stdout line by line for logging, then raises
+    CalledProcessError if Nmap exited with an error.
     """
     log_message(f"Running Nmap scan on {ip}...")
     cmd = ["nmap", "-sS", "-T4", "-Pn", ip]
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return result.stdout
-    except subprocess.CalledProcessError as e:
-        log_message(f"[!] Nmap scan error on {ip}: {e}")
-        return ""
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                          text=True, bufsize=1) as proc:
+        yield from proc.stdout
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
 
 def handle_new_device(ip, mac):
-    """Logic for new or unknown devices: log, run nmap, etc."""
+    """
+    Logic for new or unknown devices: log, run nmap, etc.
+    Returns SCAN_DONE, or SCAN_FAILED / SCAN_DEFERRED if the device should
+    be retried in a later round.
+    """
     friendly_name = KNOWN_DEVICES.get(mac, "Unknown Device")
-    log_message(f"New device detected: IP={ip}, MAC={mac}, Name={friendly_name}")
 
-    # Optional deeper scan
-    nmap_result = run_nmap_scan(ip)
-    if nmap_result:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        nmap_log_file = os.path.join(LOG_DIR, f"nmap_{ip}_{timestamp}.log")
-        with open(nmap_log_file, "w") as f:
-            f.write(nmap_result)
+    # Skip Nmap if this IP was scanned recently (e.g. a new MAC reusing a DHCP lease).
+    # Devices whose scan is postponed are only announced once.
+    with _last_nmap_scan_lock:
+        now = time.monotonic()
+        last_scan = _last_nmap_scan.get(ip)
+        if last_scan is not None and now - last_scan < NMAP_RESCAN_INTERVAL:
+            # Postpone rather than drop the scan, and only say so once per MAC
+            if mac not in _deferred_macs:
+                _deferred_macs.add(mac)
+                log_message(f"New device detected: IP={ip}, MAC={mac}, Name={friendly_name}")
+                log_message(f"Postponing Nmap scan of {mac} on {ip}, IP already scanned {int(now - last_scan)}s ago.")
+            return SCAN_DEFERRED
+        was_deferred = mac in _deferred_macs
+        _deferred_macs.discard(mac)
+    if not was_deferred:
+        log_message(f"New device detected: IP={ip}, MAC={mac}, Name={friendly_name}")
+
+    # Optional deeper scan, streamed into a temporary file that is only kept
+    # if Nmap succeeded and produced output
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    nmap_log_file = os.path.join(LOG_DIR, f"nmap_{ip}_{timestamp}.log")
+    tmp_log_file = nmap_log_file + ".part"
+    try:
+        with open(tmp_log_file, "w") as f:
+            f.writelines(run_nmap_scan(ip))
+            has_output = f.tell() > 0
+    except subprocess.CalledProcessError as e:
+        log_message(f"[!] Nmap scan error on {ip}: {e}")
+        os.remove(tmp_log_file)
+        return SCAN_FAILED
+    if has_output:
+        os.replace(tmp_log_file, nmap_log_file)
+    else:
+        os.remove(tmp_log_file)
+
+    # Only a successful scan counts towards NMAP_RESCAN_INTERVAL
+    with _last_nmap_scan_lock:
+        _last_nmap_scan[ip] = time.monotonic()
+    return SCAN_DONE
 
 # ---------------------------
 # MAIN FUNCTION
@@ -291,9 +393,17 @@ def main():
     # 4. Start airodump-ng in the background, focusing on the current BSSID & channel
     airodump_proc = launch_airodump(iface, bssid=wifi_info["bssid"], channel=wifi_info["channel"])
 
-    # 5. Signal handler for Ctrl+C
+    # Known devices plus anything handled by a previous run
+    seen_macs = set(_KNOWN_MACS) | load_seen_macs()
+
+    # Nmap scans are network bound, so new devices are scanned concurrently
+    executor = ThreadPoolExecutor(max_workers=NMAP_MAX_WORKERS)
+
+    # 5. Signal handler for Ctrl+C and SIGTERM (e.g. a systemd stop)
     def signal_handler(sig, frame):
-        log_message("Caught Ctrl+C, terminating script.")
+        log_message(f"Caught {signal.Signals(sig).name}, terminating script.")
+        save_seen_macs(seen_macs)
+        executor.shutdown(wait=False, cancel_futures=True)
         if airodump_proc:
             airodump_proc.terminate()
             airodump_proc.wait()
@@ -301,16 +411,19 @@ def main():
         sys.exit(0)
 
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
 
-    seen_macs = set(m.upper() for m in KNOWN_DEVICES.keys())
     last_nmap_time = 0
 
     # 6. Main loop: run netdiscover periodically, detect new devices, optional nmap scans
     while True:
-        discovered = run_netdiscover(wifi_info["ip_subnet"])
-        for ip, mac in discovered:
-            if mac not in seen_macs:
-                handle_new_device(ip, mac)
+        scans = {}
+        for ip, mac in run_netdiscover(wifi_info["ip_subnet"]):
+            if mac not in seen_macs and mac not in scans:
+                scans[mac] = executor.submit(handle_new_device, ip, mac)
+        # Only remember devices whose scan succeeded; failed or postponed ones are retried
+        for mac, future in scans.items():
+            if future.result() == SCAN_DONE:
                 seen_macs.add(mac)
 
         # full network scan every NMAP_FULL_SCAN_INTERVAL
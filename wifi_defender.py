@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 
+import heapq
+import json
+import logging
 import os
 import sys
 import time
 import subprocess
+import threading
 import signal
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # ---------------------------
@@ -24,15 +29,51 @@ KNOWN_DEVICES = {
     "AA:BB:CC:DD:EE:11": "My Laptop",
     "AA:BB:CC:DD:EE:22": "My Phone",
 }
+# Normalize MACs to uppercase once, matching how discovered MACs are reported
+KNOWN_DEVICES = {mac.upper(): name for mac, name in KNOWN_DEVICES.items()}
+_KNOWN_MACS = frozenset(KNOWN_DEVICES)
 
 # Directory for logs
 LOG_DIR = "./wifi_logs"
 if not os.path.exists(LOG_DIR):
     os.makedirs(LOG_DIR)
 
+# Keep one log file open for the whole run instead of reopening it per message
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+    handlers=[
+        logging.FileHandler(os.path.join(LOG_DIR, "wifi_defender.log")),
+        logging.StreamHandler(sys.stdout),
+    ],
+)
+_LOG = logging.getLogger("wifi_defender")
+
 # Log rotation
 MAX_LOG_FILES = 10  # Keep only the 10 newest logs to prevent growth
 
+# Devices already handled, kept across restarts (never rotated away)
+SEEN_MACS_FILE = os.path.join(LOG_DIR, "seen_macs.json")
+NMAP_RESCAN_INTERVAL = 3600  # Seconds before the same IP is Nmap-scanned again
+NMAP_MAX_WORKERS = 8         # Nmap scans of new devices run in parallel
+
+# IP and MAC columns of a netdiscover result line, e.g.
+# 192.168.1.10   00:11:22:33:44:55   1      60   SomeVendor
+_IP_RE = re.compile(r"^(\d+\.\d+\.\d+\.\d+)\s+([0-9A-Fa-f:]{17})")
+
+# Last Nmap scan time (time.monotonic()) per IP, shared by the scan workers
+_last_nmap_scan = {}
+_last_nmap_scan_lock = threading.Lock()
+
+# MACs whose scan is postponed because their IP was scanned recently
+_deferred_macs = set()
+
+# Results of handle_new_device(); only SCAN_DONE marks a device as seen
+SCAN_DONE = "done"
+SCAN_FAILED = "failed"
+SCAN_DEFERRED = "deferred"
+
 # ---------------------------
 # HELPER FUNCTIONS
 # ---------------------------
@@ -45,18 +86,35 @@ def check_root():
 
 def rotate_logs(directory):
     """Keep only the newest logs up to MAX_LOG_FILES."""
-    files = sorted(os.listdir(directory), key=lambda x: os.path.getmtime(os.path.join(directory, x)))
-    while len(files) > MAX_LOG_FILES:
-        oldest = files.pop(0)
-        os.remove(os.path.join(directory, oldest))
+    # DirEntry.stat() reuses one stat per file; only order when over the limit
+    with os.scandir(directory) as it:
+        entries = [(e.stat().st_mtime, e.path) for e in it
+                   if e.is_file() and e.name != os.path.basename(SEEN_MACS_FILE)]
+    if len(entries) <= MAX_LOG_FILES:
+        return
+    for _, oldest in heapq.nsmallest(len(entries) - MAX_LOG_FILES, entries):
+        os.remove(oldest)
+
+def load_seen_macs():
+    """Return the MACs handled by previous runs, or an empty set."""
+    try:
+        with open(SEEN_MACS_FILE) as f:
+            macs = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    # Ignore anything that isn't the list of MAC strings save_seen_macs() writes
+    if not isinstance(macs, list):
+        return set()
+    return {mac.upper() for mac in macs if isinstance(mac, str)}
+
+def save_seen_macs(seen_macs):
+    """Save handled MACs so a restart does not re-scan every device."""
+    with open(SEEN_MACS_FILE, "w") as f:
+        json.dump(sorted(seen_macs - _KNOWN_MACS), f)
 
 def log_message(message):
     """Write a log entry to file and also print to console."""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_file_path = os.path.join(LOG_DIR, "wifi_defender.log")
-    with open(log_file_path, "a") as f:
-        f.write(f"[{timestamp}] {message}\n")
-    print(f"[{timestamp}] {message}")
+    _LOG.info(message)
 
 def set_monitor_mode(interface):
     """Set the specified interface into monitor mode."""
@@ -98,57 +156,85 @@ def launch_airodump(interface):
 def run_netdiscover(subnet):
     """
     Run netdiscover in passive/active hybrid mode to detect hosts.  
-    We'll parse the output for new devices.
+    Yields (ip, mac) for each device as soon as netdiscover prints it.
     """
     log_message(f"Running netdiscover on {subnet}...")
     cmd = ["netdiscover", "-r", subnet]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                          text=True, bufsize=1) as proc:
+        for line in proc.stdout:
+            m = _IP_RE.match(line)
+            if m:
+                yield m.group(1), m.group(2).upper()
+    if proc.returncode != 0:
         log_message("[!] netdiscover command failed. Check if netdiscover is installed.")
-        return
-
-    lines = result.stdout.strip().split('\n')
-    discovered_devices = []
-    # Typical netdiscover line example:
-    # 192.168.1.10   00:11:22:33:44:55   1      60   Intel Corporate
-    for line in lines:
-        if re.match(r"^\d+\.\d+\.\d+\.\d+", line):
-            parts = line.split()
-            if len(parts) >= 2:
-                ip = parts[0]
-                mac = parts[1].upper()
-                discovered_devices.append((ip, mac))
-
-    return discovered_devices
 
 def run_nmap_scan(target_ip):
     """
     Run an Nmap scan for open ports or vulnerabilities on a single target IP.
     This can be modified for deeper scans (e.g., -sV, -O, --script).
+    Yields the output line by line as Nmap produces it, then raises
+    CalledProcessError if Nmap exited with an error.
     """
     log_message(f"Running Nmap scan on {target_ip}...")
     cmd = ["nmap", "-sS", "-T4", "-Pn", target_ip]  # Stealth SYN scan, no ping
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    return result.stdout
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                          text=True, bufsize=1) as proc:
+        yield from proc.stdout
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
 
 def handle_new_device(ip, mac):
     """
     Logic to handle new or unknown devices.
     Possibly alert, log heavily, or run a deeper Nmap scan.
+    Returns SCAN_DONE, or SCAN_FAILED / SCAN_DEFERRED if the device should
+    be retried in a later round.
     """
     friendly_name = KNOWN_DEVICES.get(mac, "Unknown Device")
-    log_message(f"Detected new or unknown device: MAC={mac}, IP={ip}, Label={friendly_name}")
 
-    # Optionally run an Nmap scan
-    nmap_output = run_nmap_scan(ip)
-    # Save the Nmap output to a file
+    # Skip Nmap if this IP was scanned recently (e.g. a new MAC reusing a DHCP lease).
+    # Devices whose scan is postponed are only announced once.
+    with _last_nmap_scan_lock:
+        now = time.monotonic()
+        last_scan = _last_nmap_scan.get(ip)
+        if last_scan is not None and now - last_scan < NMAP_RESCAN_INTERVAL:
+            # Postpone rather than drop the scan, and only say so once per MAC
+            if mac not in _deferred_macs:
+                _deferred_macs.add(mac)
+                log_message(f"Detected new or unknown device: MAC={mac}, IP={ip}, Label={friendly_name}")
+                log_message(f"Postponing Nmap scan of {mac} on {ip}, IP already scanned {int(now - last_scan)}s ago.")
+            return SCAN_DEFERRED
+        was_deferred = mac in _deferred_macs
+        _deferred_macs.discard(mac)
+    if not was_deferred:
+        log_message(f"Detected new or unknown device: MAC={mac}, IP={ip}, Label={friendly_name}")
+
+    # Optionally run an Nmap scan, streaming its output into a temporary file
+    # that is only kept if Nmap succeeded and produced output
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     nmap_log_file = os.path.join(LOG_DIR, f"nmap_{ip}_{timestamp}.log")
-    with open(nmap_log_file, "w") as f:
-        f.write(nmap_output)
+    tmp_log_file = nmap_log_file + ".part"
+    try:
+        with open(tmp_log_file, "w") as f:
+            f.writelines(run_nmap_scan(ip))
+            has_output = f.tell() > 0
+    except subprocess.CalledProcessError as e:
+        log_message(f"[!] Nmap scan error on {ip}: {e}")
+        os.remove(tmp_log_file)
+        return SCAN_FAILED
+    if has_output:
+        os.replace(tmp_log_file, nmap_log_file)
+    else:
+        os.remove(tmp_log_file)
 
     # If you suspect a rogue device, you could incorporate iptables blocks or further investigations
 
+    # Only a successful scan counts towards NMAP_RESCAN_INTERVAL
+    with _last_nmap_scan_lock:
+        _last_nmap_scan[ip] = time.monotonic()
+    return SCAN_DONE
+
 # ---------------------------
 # MAIN ROUTINE
 # ---------------------------
@@ -164,12 +250,16 @@ def main():
     airodump_proc = launch_airodump(MONITOR_INTERFACE)
 
     # Track devices we have seen to avoid repeated alerts
-    known_macs = set(m.upper() for m in KNOWN_DEVICES.keys())
-    seen_macs = set(known_macs)  # start with known devices
+    seen_macs = set(_KNOWN_MACS) | load_seen_macs()  # start with known and previously seen devices
+
+    # Nmap scans are network bound, so new devices are scanned concurrently
+    executor = ThreadPoolExecutor(max_workers=NMAP_MAX_WORKERS)
 
-    # Capture Ctrl+C to restore managed mode before exit
+    # Capture Ctrl+C (and SIGTERM, e.g. from systemd) to restore managed mode before exit
     def signal_handler(sig, frame):
         log_message("Caught interrupt signal. Cleaning up...")
+        save_seen_macs(seen_macs)
+        executor.shutdown(wait=False, cancel_futures=True)
         if airodump_proc:
             airodump_proc.terminate()
             airodump_proc.wait()
@@ -177,18 +267,21 @@ def main():
         sys.exit(0)
 
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
 
     # MAIN LOOP
     last_nmap_time = 0
     while True:
         # 1. Run netdiscover to see who is on the subnet
-        discovered = run_netdiscover(LOCAL_SUBNET)
-        if discovered:
-            for ip, mac in discovered:
-                # If it's not in seen_macs, handle it as a new device
-                if mac not in seen_macs:
-                    handle_new_device(ip, mac)
-                    seen_macs.add(mac)
+        scans = {}
+        for ip, mac in run_netdiscover(LOCAL_SUBNET):
+            # If it's not in seen_macs, handle it as a new device
+            if mac not in seen_macs and mac not in scans:
+                scans[mac] = executor.submit(handle_new_device, ip, mac)
+        # Wait for this round's scans; failed or postponed devices are retried next round
+        for mac, future in scans.items():
+            if future.result() == SCAN_DONE:
+                seen_macs.add(mac)
 
         # 2. Optionally run a full nmap scan across entire subnet every NMAP_FULL_SCAN_INTERVAL
         current_time = time.time()